@@ -1,8 +1,35 @@
 from __future__ import annotations
 
 import ast
+import builtins
+import marshal
+import multiprocessing
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+from types import CodeType
 from typing import Any, Dict
 
+# Неинтерактивный backend: графики только сохраняются в файлы, GUI не нужен.
+# Должен быть выставлен до первого импорта matplotlib.pyplot.
+import matplotlib
+
+matplotlib.use("Agg", force=True)
+
+# Модули, которые почти всегда нужны сгенерированному коду, импортируем один раз
+import matplotlib.pyplot as _plt
+import numpy as _np
+import pandas as _pd
+import seaborn as _sns
+
+# Упрощаем отрисовку: без constrained layout и с максимальным упрощением путей
+_plt.rcParams["figure.constrained_layout.use"] = False
+_plt.rcParams["path.simplify_threshold"] = 1.0
+
+from data_utils import load_vacancies as _load_vacancies
+
 
 class CodeValidationError(Exception):
     """Raised when generated code is considered unsafe."""
@@ -40,63 +67,214 @@ FORBIDDEN_MODULE_PREFIXES = (
 )
 
 
-def _validate_code_safety(code: str) -> None:
+# Корневые пакеты разрешённых модулей (для проверки "from X.Y import ...")
+_ALLOWED_ROOTS = frozenset(m.split(".")[0] for m in ALLOWED_MODULES)
+_FORBIDDEN_CALLS = frozenset(FORBIDDEN_CALLS)
+# Запрещённый модуль или любой его подмодуль ("sys", "sys.path", но не "sysconfig")
+_FORBIDDEN_MODULE_RE = re.compile(
+    "^(?:" + "|".join(re.escape(p) for p in FORBIDDEN_MODULE_PREFIXES) + r")(?:\.|$)"
+)
+
+
+class _SafetyVisitor(ast.NodeVisitor):
+    """Обходит AST и выбрасывает CodeValidationError на запрещённых конструкциях."""
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            name = alias.name
+            # Разрешаем только ALLOWED_MODULES и явно блокируем модули из FORBIDDEN_MODULE_PREFIXES
+            if _FORBIDDEN_MODULE_RE.match(name):
+                raise CodeValidationError(f"Import of module '{name}' is not allowed")
+            if name not in ALLOWED_MODULES:
+                raise CodeValidationError(f"Import of module '{name}' is not allowed")
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        module = node.module or ""
+        if _FORBIDDEN_MODULE_RE.match(module):
+            raise CodeValidationError(f"Import from module '{module}' is not allowed")
+        # Разрешаем from pandas / matplotlib / seaborn / numpy / os / pathlib
+        if module not in ALLOWED_MODULES and module.split(".")[0] not in _ALLOWED_ROOTS:
+            raise CodeValidationError(f"Import from module '{module}' is not allowed")
+
+    def visit_Call(self, node: ast.Call) -> None:
+        # Вызовы по имени: open(...), eval(...), exec(...)
+        if isinstance(node.func, ast.Name):
+            if node.func.id in _FORBIDDEN_CALLS:
+                raise CodeValidationError(f"Call to '{node.func.id}' is not allowed")
+
+        # Вызовы через атрибут: os.system, subprocess.run и т.п.
+        if isinstance(node.func, ast.Attribute):
+            attr_name = node.func.attr
+            if attr_name in _FORBIDDEN_CALLS:
+                raise CodeValidationError(f"Call to attribute '{attr_name}' is not allowed")
+
+        self.generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant) -> None:
+        # В литералах проверять нечего
+        return
+
+
+def _parse_code(code: str) -> ast.Module:
+    """Разбирает исходный код в AST (без компиляции в байткод)."""
+    try:
+        return compile(
+            code,
+            "<llm_generated>",
+            "exec",
+            flags=ast.PyCF_ONLY_AST,
+            dont_inherit=True,
+        )
+    except SyntaxError as e:
+        raise CodeValidationError(f"Generated code has syntax error: {e}") from e
+
+
+def _validate_code_safety(code: str | ast.AST) -> None:
     """
     Best-effort валидация Python-кода перед exec.
 
     - Разрешаем только ограниченный набор модулей для import.
     - Запрещаем некоторые опасные вызовы (exec, eval, open, subprocess.* и т.п.).
+
+    Принимает исходный код или уже разобранное AST.
     """
-    try:
-        tree = ast.parse(code)
-    except SyntaxError as e:
-        raise CodeValidationError(f"Generated code has syntax error: {e}") from e
+    tree = _parse_code(code) if isinstance(code, str) else code
+    _SafetyVisitor().visit(tree)
 
-    for node in ast.walk(tree):
-        # Ограничиваем импортируемые модули
-        if isinstance(node, ast.Import):
-            for alias in node.names:
-                name = alias.name
-                # Разрешаем только ALLOWED_MODULES и явно блокируем модули из FORBIDDEN_MODULE_PREFIXES
-                if any(name.startswith(prefix) for prefix in FORBIDDEN_MODULE_PREFIXES):
-                    raise CodeValidationError(f"Import of module '{name}' is not allowed")
-                if name not in ALLOWED_MODULES:
-                    raise CodeValidationError(f"Import of module '{name}' is not allowed")
-
-        if isinstance(node, ast.ImportFrom):
-            module = node.module or ""
-            if module not in ALLOWED_MODULES and not any(
-                module.startswith(prefix) for prefix in FORBIDDEN_MODULE_PREFIXES
-            ):
-                # Разрешаем from pandas / matplotlib / seaborn / numpy / os / pathlib
-                if module.split(".")[0] not in {m.split(".")[0] for m in ALLOWED_MODULES}:
-                    raise CodeValidationError(f"Import from module '{module}' is not allowed")
-
-        # Запрещаем прямые вызовы опасных функций
-        if isinstance(node, ast.Call):
-            # Вызовы по имени: open(...), eval(...), exec(...)
-            if isinstance(node.func, ast.Name):
-                if node.func.id in FORBIDDEN_CALLS:
-                    raise CodeValidationError(f"Call to '{node.func.id}' is not allowed")
-
-            # Вызовы через атрибут: os.system, subprocess.run и т.п.
-            if isinstance(node.func, ast.Attribute):
-                attr_name = node.func.attr
-                if attr_name in FORBIDDEN_CALLS:
-                    raise CodeValidationError(f"Call to attribute '{attr_name}' is not allowed")
 
+# Встроенные функции, доступные сгенерированному коду (без open/exec/eval/compile и т.п.).
+# locals/globals/vars безопасны: они видят только собственный namespace скрипта.
+_SAFE_BUILTINS = (
+    "abs", "aiter", "all", "anext", "any", "ascii", "bin", "bool", "bytearray", "bytes",
+    "callable", "chr", "classmethod", "complex", "delattr", "dict", "dir", "divmod",
+    "enumerate", "filter", "float", "format", "frozenset", "getattr", "globals",
+    "hasattr", "hash", "hex", "id", "int", "isinstance", "issubclass", "iter", "len",
+    "list", "locals", "map", "max", "memoryview", "min", "next", "object", "oct", "ord",
+    "pow", "print", "property", "range", "repr", "reversed", "round", "set", "setattr",
+    "slice", "sorted", "staticmethod", "str", "sum", "super", "tuple", "type", "vars",
+    "zip", "None", "True", "False", "Ellipsis", "NotImplemented", "__build_class__",
+    "__debug__",
+)
 
-def execute_generated_code(code: str) -> Dict[str, Any]:
+
+def _restricted_import(
+    name: str,
+    globals: Dict[str, Any] | None = None,
+    locals: Dict[str, Any] | None = None,
+    fromlist: Any = (),
+    level: int = 0,
+) -> Any:
+    """Обёртка над __import__, пропускающая только разрешённые модули."""
+    if level != 0 or name.split(".")[0] not in _ALLOWED_ROOTS:
+        raise ImportError(f"Import of module '{name}' is not allowed")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+_restricted_builtins: Dict[str, Any] = {k: getattr(builtins, k) for k in _SAFE_BUILTINS}
+# Все классы исключений (ValueError, KeyError и т.п.) тоже разрешены
+_restricted_builtins.update(
+    {
+        k: v
+        for k, v in vars(builtins).items()
+        if isinstance(v, type) and issubclass(v, BaseException)
+    }
+)
+_restricted_builtins["__import__"] = _restricted_import
+
+
+@lru_cache(maxsize=32)
+def _compile_code(code: str) -> CodeType:
+    """
+    Валидирует и компилирует сгенерированный код в байткод.
+
+    Исходник разбирается один раз: AST проверяется и затем компилируется
+    напрямую. Результат кешируется, поэтому повторный запуск того же кода
+    (например, при повторных попытках) не разбирает его заново.
     """
-    Валидирует и выполняет сгенерированный ЛЛМ код.
+    tree = _parse_code(code)
+    _validate_code_safety(tree)
+    return compile(tree, "<llm_generated>", "exec", dont_inherit=True)
+
+
+# Сгенерированный код выполняется в короткоживущем дочернем процессе, чтобы
+# графики, датафреймы и глобальные переменные не накапливались в основном.
+# forkserver заранее импортирует этот модуль (pandas, matplotlib и т.д.),
+# поэтому дочерним процессам не нужно импортировать их заново. Однако каждый
+# дочерний процесс всё равно импортирует __main__ вызывающего скрипта
+# (как __mp_main__): вызов стоит ~60-80 мс для main.py и больше для
+# telegram_bot.py (aiogram), а скрипт обязан иметь guard
+# if __name__ == "__main__".
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _mp_context = multiprocessing.get_context("forkserver")
+    _mp_context.set_forkserver_preload([__name__])
+else:
+    _mp_context = multiprocessing.get_context("spawn")
+
+
+def _to_plain_data(obj: Any) -> Any:
+    """
+    Преобразует результат в простые Python типы, которые можно передать
+    из дочернего процесса (объекты классов из сгенерированного кода,
+    лямбды и т.п. не пиклятся).
+    """
+    if obj is None or type(obj) in (str, bool, int, float):
+        return obj
+    if isinstance(obj, dict):
+        result = {}
+        for key, value in obj.items():
+            plain_key = _to_plain_data(key)
+            if isinstance(plain_key, (list, dict)):
+                plain_key = str(key)
+            result[plain_key] = _to_plain_data(value)
+        return result
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_to_plain_data(item) for item in obj]
+    if isinstance(obj, _np.generic):
+        return _to_plain_data(obj.item())
+    if isinstance(obj, _np.ndarray):
+        return _to_plain_data(obj.tolist())
+    if isinstance(obj, (_pd.Series, _pd.DataFrame)):
+        return _to_plain_data(obj.to_dict())
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _is_picklable(obj: Any) -> bool:
+    """Проверяет, что объект можно передать между процессами и восстановить."""
+    try:
+        pickle.loads(pickle.dumps(obj))
+    except Exception:  # noqa: BLE001
+        return False
+    return True
+
+
+def _run_compiled_code(code_bytes: bytes) -> Dict[str, Any]:
+    """
+    Выполняет скомпилированный код в дочернем процессе.
 
     Возвращает словарь ANALYTICS_RESULT из выполненного скрипта.
     """
-    _validate_code_safety(code)
+    code_obj = marshal.loads(code_bytes)
 
-    # Выполняем код в отдельном namespace
-    exec_namespace: Dict[str, Any] = {}
-    exec(code, exec_namespace, exec_namespace)
+    # Выполняем код в отдельном namespace с уже импортированными модулями
+    exec_namespace: Dict[str, Any] = {
+        "pd": _pd,
+        "np": _np,
+        "plt": _plt,
+        "sns": _sns,
+        "load_vacancies": _load_vacancies,
+        "__builtins__": _restricted_builtins,
+        "__name__": "__main__",
+    }
+    try:
+        exec(code_obj, exec_namespace, exec_namespace)
+    except Exception as e:
+        # Исключения классов из сгенерированного кода или с непиклящимися
+        # аргументами нельзя передать в родительский процесс
+        if not _is_picklable(e):
+            raise RuntimeError(f"{type(e).__name__}: {e}") from None
+        raise
 
     if "ANALYTICS_RESULT" not in exec_namespace:
         raise CodeValidationError("Generated code did not define 'ANALYTICS_RESULT'")
@@ -105,6 +283,22 @@ def execute_generated_code(code: str) -> Dict[str, Any]:
     if not isinstance(result, dict):
         raise CodeValidationError("'ANALYTICS_RESULT' must be a dict")
 
-    return result
+    return _to_plain_data(result)
+
 
+def execute_generated_code(code: str) -> Dict[str, Any]:
+    """
+    Валидирует и выполняет сгенерированный ЛЛМ код в отдельном процессе.
+
+    Возвращает словарь ANALYTICS_RESULT из выполненного скрипта.
+
+    Дочерний процесс импортирует главный модуль вызывающей программы,
+    поэтому её код запуска должен быть под if __name__ == "__main__",
+    иначе вызов завершится ошибкой BrokenProcessPool.
+    """
+    # Валидация и компиляция - в текущем процессе (с кешем), в дочерний
+    # передаём уже готовый байткод
+    code_bytes = marshal.dumps(_compile_code(code))
 
+    with ProcessPoolExecutor(max_workers=1, mp_context=_mp_context) as executor:
+        return executor.submit(_run_compiled_code, code_bytes).result()
@@ -1,14 +1,17 @@
 import os
 from pathlib import Path
 
-from dotenv import load_dotenv
+try:
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv опционален, если переменные заданы в окружении
+    load_dotenv = None
 
 
 BASE_DIR = Path(__file__).resolve().parent
 
 # Явная загрузка .env из корня проекта
 env_path = BASE_DIR / ".env"
-if env_path.exists():
+if load_dotenv is not None and env_path.exists():
     load_dotenv(dotenv_path=env_path)
 
 
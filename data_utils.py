@@ -1,11 +1,25 @@
 from __future__ import annotations
 
 import json
+import os
+import tempfile
 from pathlib import Path
 from typing import Any, Dict, Tuple
 
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:  # orjson опционален, без него используем stdlib json
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # без pyarrow кеш вакансий не используется
+    pa = None
+    feather = None
+
 
 def load_description(path: str | Path = "description.json") -> Tuple[Dict[str, str], Dict[str, Any]]:
     """
@@ -45,12 +59,159 @@ def load_description(path: str | Path = "description.json") -> Tuple[Dict[str, s
         field_type = field.get("type", "string")
         # Маппим типы из JSON в pandas dtypes
         pandas_dtype = type_mapping.get(field_type, "object")
+        # Эти колонки load_vacancies парсит в datetime
+        if field_name in DATE_COLUMNS:
+            pandas_dtype = "datetime64[ns]"
         structure_info[field_name] = pandas_dtype
     
     return structure_info, description_data
 import numpy as np
 
 
+DATE_COLUMNS = ("published_at",)  # Колонки с датами в формате ISO 8601
+
+
+def _parse_date_columns(df: pd.DataFrame) -> None:
+    """
+    Переводит колонки с датами из DATE_COLUMNS в datetime (in-place).
+
+    Остальные строковые колонки остаются object, как описано в промпте.
+    """
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format="ISO8601", errors="coerce", cache=True)
+
+
+DESCRIBE_SAMPLE_SIZE = 10_000  # Максимум строк для расчёта медиан и частот
+
+
+def _to_native(value: Any) -> Any:
+    """Преобразует numpy/pandas скаляры в нативные Python типы."""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _summarize_columns(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """
+    Строит краткое JSON-сериализуемое описание колонок датафрейма.
+
+    Медианы и частоты значений считаются по случайной выборке
+    не более DESCRIBE_SAMPLE_SIZE строк, количество, минимум и максимум -
+    по всем строкам.
+    """
+    if len(df) > DESCRIBE_SAMPLE_SIZE:
+        sample = df.sample(n=DESCRIBE_SAMPLE_SIZE, random_state=0)
+    else:
+        sample = df
+
+    counts = df.count()
+    summary: Dict[str, Dict[str, Any]] = {
+        col: {"count": int(counts[col])} for col in df.columns
+    }
+
+    # min/max/count дешёвые (O(N)) - по всем строкам, медиана - по выборке
+    for col in df.select_dtypes("number").columns:
+        if not counts[col]:
+            continue
+        summary[col]["min"] = _to_native(df[col].min())
+        summary[col]["max"] = _to_native(df[col].max())
+        median = sample[col].median()
+        if pd.notna(median):
+            summary[col]["median"] = _to_native(median)
+
+    for col in sample.select_dtypes("datetime").columns:
+        if counts[col]:
+            summary[col]["min"] = _to_native(df[col].min())
+            summary[col]["max"] = _to_native(df[col].max())
+
+    for col in sample.select_dtypes(include=["object", "string", "category"]).columns:
+        try:
+            top = sample[col].value_counts().head(5)
+        except TypeError:
+            # Колонки со списками не хешируются
+            continue
+        summary[col]["top"] = {str(k): int(v) for k, v in top.items() if v}
+
+    return summary
+
+
+VACANCIES_CACHE_VERSION = 3  # Увеличивать при изменении обработки колонок
+_CACHE_META_KEY = b"vacancies_cache"
+
+
+def _cache_path(path: Path) -> Path:
+    """Путь к feather-кешу рядом с исходным файлом: data/o.json -> data/.o.json.cache.feather."""
+    return path.with_name(f".{path.name}.cache.feather")
+
+
+def _cache_meta(path: Path) -> bytes:
+    """Метаданные исходного файла, по которым проверяется актуальность кеша."""
+    stat = path.stat()
+    meta = {
+        "version": VACANCIES_CACHE_VERSION,
+        "path": str(path.resolve()),
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+    return json.dumps(meta, sort_keys=True).encode("utf-8")
+
+
+def _read_vacancies_cache(path: Path, meta: bytes) -> pd.DataFrame | None:
+    """
+    Возвращает датафрейм из feather-кеша, если кеш построен
+    для этого же файла с теми же mtime и размером, иначе None.
+
+    Метаданные хранятся в схеме самого feather-файла, поэтому данные
+    и метаданные всегда читаются согласованно.
+    """
+    cache_path = _cache_path(path)
+    if feather is None or not cache_path.exists():
+        return None
+    try:
+        table = feather.read_table(cache_path)
+        if (table.schema.metadata or {}).get(_CACHE_META_KEY) != meta:
+            return None
+        df = table.to_pandas()
+    except (OSError, ValueError, pa.ArrowException):
+        # Повреждённый кеш - просто перечитываем JSON
+        return None
+
+    # Arrow возвращает списки как numpy-массивы - приводим обратно к list
+    for col in df.columns[df.dtypes == object]:
+        first = df[col].first_valid_index()
+        if first is not None and isinstance(df[col].at[first], np.ndarray):
+            df[col] = df[col].map(lambda v: v.tolist() if isinstance(v, np.ndarray) else v)
+    return df
+
+
+def _write_vacancies_cache(path: Path, df: pd.DataFrame, meta: bytes) -> None:
+    """
+    Сохраняет датафрейм в feather-кеш с метаданными исходного файла в схеме.
+
+    Файл пишется во временный и атомарно подменяется через os.replace,
+    чтобы параллельные загрузки не видели недописанный кеш.
+    """
+    if feather is None:
+        return
+    cache_path = _cache_path(path)
+    tmp_path = None
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), _CACHE_META_KEY: meta})
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, prefix=cache_path.name, delete=False) as f:
+            tmp_path = f.name
+        feather.write_feather(table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception:  # noqa: BLE001
+        # Кеш - только оптимизация, ошибки записи (нет прав, неподдерживаемые
+        # типы колонок) не должны ломать загрузку данных
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+
+
 def load_vacancies(
     path: str | Path = "vacancies.json",
 ) -> Tuple[pd.DataFrame, pd.Series, Dict[str, Dict[str, Any]]]:
@@ -72,21 +233,34 @@ def load_vacancies(
         Структура датафрейма: типы данных по каждому столбцу (df.dtypes).
     description : Dict[str, Dict[str, Any]]
         Описание датафрейма: словарь, где ключи - названия колонок,
-        значения - словари с метриками для каждой колонки (без nan).
+        значения - словари с метриками для каждой колонки (без nan):
+        count/min/max/median для числовых колонок, count и top-5 значений
+        для строковых. Все значения JSON-сериализуемые.
     """
     path = Path(path)
 
+    # Если файл не менялся с прошлого запуска - берём готовый датафрейм из кеша
+    meta = _cache_meta(path)
+    df = _read_vacancies_cache(path, meta)
+    if df is not None:
+        return df, df.dtypes, _summarize_columns(df)
+
     # Читаем JSON файл - теперь это плоский массив объектов
-    with path.open("r", encoding="utf-8") as f:
-        raw = json.load(f)
+    if orjson is not None:
+        raw = orjson.loads(path.read_bytes())
+    else:
+        with path.open("r", encoding="utf-8") as f:
+            raw = json.load(f)
 
     # Создаем DataFrame напрямую из списка словарей
     df = pd.DataFrame(raw)
+    _parse_date_columns(df)
+    _write_vacancies_cache(path, df, meta)
 
     # Структура датафрейма
     structure = df.dtypes
 
-    # Улучшенное описание: убираем nan и делаем более структурированным
-    description = df.describe()
+    # Краткое описание колонок (вместо полного df.describe)
+    description = _summarize_columns(df)
 
     return df, structure, description
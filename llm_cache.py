@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson опционален, без него используем stdlib json
+    import json
+
+    orjson = None
+
+try:
+    import diskcache
+except ImportError:  # без diskcache кеш живёт только в памяти процесса
+    diskcache = None
+
+
+DEFAULT_CACHE_DIR = Path(".llm_cache")
+DEFAULT_TTL = 86400  # Время жизни записи в кеше (секунды)
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    """
+    Строит ключ кеша по модели, сообщениям и температуре запроса.
+    """
+    key_data = {"model": model, "messages": messages, "temperature": temperature}
+    if orjson is not None:
+        raw = orjson.dumps(key_data, option=orjson.OPT_SORT_KEYS)
+    else:
+        raw = json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class LLMCache:
+    """
+    Кеш ответов LLM по точному совпадению запроса.
+
+    Если установлен diskcache, ответы сохраняются на диск и переживают
+    перезапуск, иначе хранятся в памяти процесса.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path = DEFAULT_CACHE_DIR,
+        ttl: int = DEFAULT_TTL,
+        enabled: bool = True,
+    ) -> None:
+        self.ttl = ttl
+        self.enabled = enabled
+        self._disk = diskcache.Cache(str(directory)) if enabled and diskcache is not None else None
+        self._memory: Dict[str, Tuple[float, Any]] = {}
+        self._lock = Lock()
+
+    def get(self, key: str) -> Any | None:
+        """Возвращает закешированный ответ или None."""
+        if not self.enabled:
+            return None
+        if self._disk is not None:
+            return self._disk.get(key)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Сохраняет ответ в кеш."""
+        if not self.enabled:
+            return
+        if self._disk is not None:
+            self._disk.set(key, value, expire=self.ttl)
+            return
+
+        with self._lock:
+            self._memory[key] = (time.time() + self.ttl, value)
+
+    def delete(self, key: str) -> None:
+        """Удаляет запись из кеша, если она есть."""
+        if not self.enabled:
+            return
+        if self._disk is not None:
+            self._disk.delete(key)
+            return
+
+        with self._lock:
+            self._memory.pop(key, None)
+
+    def close(self) -> None:
+        """Закрывает дисковый кеш, если он используется."""
+        if self._disk is not None:
+            self._disk.close()
@@ -1,10 +1,21 @@
+import atexit
 import os
 import re
 import time
-from threading import Lock
+from threading import Event, Lock
 from typing import Any, Dict
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from llm_cache import LLMCache, make_cache_key
+
+try:
+    import orjson
+except ImportError:  # orjson опционален, без него используем stdlib json
+    import json
+
+    orjson = None
 
 
 # Глобальная переменная для отслеживания времени последнего запроса
@@ -13,6 +24,62 @@ _request_lock = Lock()
 API_REQUEST_DELAY = 1.0  # Минимальная задержка между запросами в секундах
 MAX_RETRY_WAIT_TIME = 30  # Максимальное время ожидания при 429 ошибке (секунды)
 
+# Первый блок ```...``` в ответе модели (нежадно, чтобы не захватить несколько блоков)
+_CODE_FENCE_RE = re.compile(r"```(?:python)?(.*?)```", re.DOTALL | re.IGNORECASE)
+_CODE_PREFIX = "code:"
+
+
+class LLMRequestCancelled(Exception):
+    """Raised when a streaming LLM request is cancelled via cancel_event."""
+
+# Общая HTTP-сессия: TCP/TLS соединения к API переиспользуются между запросами
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+atexit.register(_session.close)
+
+# Кеш ответов LLM, отключается через LLM_CACHE=false
+_llm_cache = LLMCache(enabled=os.getenv("LLM_CACHE", "true").lower() == "true")
+atexit.register(_llm_cache.close)
+
+
+# Строится один раз при импорте: байт-в-байт одинаковый префикс кешируется на стороне API
+_SYSTEM_PROMPT = (
+    "You are an expert Python data analyst and engineer. "
+    "You write **only** pure executable Python 3 code (no markdown, "
+    "no backticks, no shell or bash commands, no comments outside of Python code). "
+    "Your code will be executed in a local environment that already has "
+    "pandas, matplotlib, seaborn, numpy and the standard library installed.\n\n"
+    "You receive a natural-language user task and a description of a dataset "
+    "that has already been preprocessed in the caller. The caller uses a helper "
+    "function 'load_vacancies' from the local module 'data_utils' to load the "
+    "data from 'vacancies.json' and flatten the nested 'data' field into a "
+    "convenient DataFrame.\n\n"
+    "Your job is to:\n"
+    "1. Import and use the helper function from 'data_utils' instead of reading "
+    "the JSON file directly. Your typical pattern should be:\n"
+    "   from data_utils import load_vacancies\n"
+    "   df, structure, description = load_vacancies()\n"
+    "2. Compute exactly the analytics requested by the user (aggregations, "
+    "statistics, segments, time series, etc.).\n"
+    "3. If the user asks for plots, create them using matplotlib or seaborn, "
+    "save them to PNG files on disk, and include their file paths in the result.\n"
+    "4. At the end of the script, construct a Python dictionary named "
+    "'ANALYTICS_RESULT' that contains:\n"
+    "   - a key 'metrics' with a nested dict of all numeric and other metrics you computed;\n"
+    "   - a key 'plots' with a list of dicts, each containing at least 'name' and 'path' "
+    "for every saved plot.\n"
+    "5. Do not print huge dataframes; if needed, aggregate or sample them. Focus on "
+    "meaningful metrics.\n\n"
+    "Important constraints:\n"
+    "- Do not import or use any network libraries or call remote APIs.\n"
+    "- Do not read from or write to any files other than 'vacancies.json' (through "
+    "the provided helper function) and image files for plots.\n"
+    "- Do not install packages. Use only pandas, matplotlib, seaborn, numpy, os, pathlib, datetime.\n"
+    "- Never output any bash/shell snippets or commands (such as rm, cd, ls, chmod, curl, wget, etc.).\n"
+    "- The ONLY thing you must return to the caller is valid Python code. "
+    "No explanations, no comments outside the code block, no additional text."
+)
+
 
 def get_system_prompt() -> str:
     """
@@ -22,42 +89,7 @@ def get_system_prompt() -> str:
     - reading data from vacancies.json,
     - saving plots to disk and returning paths to them in a dictionary.
     """
-    return (
-        "You are an expert Python data analyst and engineer. "
-        "You write **only** pure executable Python 3 code (no markdown, "
-        "no backticks, no shell or bash commands, no comments outside of Python code). "
-        "Your code will be executed in a local environment that already has "
-        "pandas, matplotlib, seaborn, numpy and the standard library installed.\n\n"
-        "You receive a natural-language user task and a description of a dataset "
-        "that has already been preprocessed in the caller. The caller uses a helper "
-        "function 'load_vacancies' from the local module 'data_utils' to load the "
-        "data from 'vacancies.json' and flatten the nested 'data' field into a "
-        "convenient DataFrame.\n\n"
-        "Your job is to:\n"
-        "1. Import and use the helper function from 'data_utils' instead of reading "
-        "the JSON file directly. Your typical pattern should be:\n"
-        "   from data_utils import load_vacancies\n"
-        "   df, structure, description = load_vacancies()\n"
-        "2. Compute exactly the analytics requested by the user (aggregations, "
-        "statistics, segments, time series, etc.).\n"
-        "3. If the user asks for plots, create them using matplotlib or seaborn, "
-        "save them to PNG files on disk, and include their file paths in the result.\n"
-        "4. At the end of the script, construct a Python dictionary named "
-        "'ANALYTICS_RESULT' that contains:\n"
-        "   - a key 'metrics' with a nested dict of all numeric and other metrics you computed;\n"
-        "   - a key 'plots' with a list of dicts, each containing at least 'name' and 'path' "
-        "for every saved plot.\n"
-        "5. Do not print huge dataframes; if needed, aggregate or sample them. Focus on "
-        "meaningful metrics.\n\n"
-        "Important constraints:\n"
-        "- Do not import or use any network libraries or call remote APIs.\n"
-        "- Do not read from or write to any files other than 'vacancies.json' (through "
-        "the provided helper function) and image files for plots.\n"
-        "- Do not install packages. Use only pandas, matplotlib, seaborn, numpy, os, pathlib, datetime.\n"
-        "- Never output any bash/shell snippets or commands (such as rm, cd, ls, chmod, curl, wget, etc.).\n"
-        "- The ONLY thing you must return to the caller is valid Python code. "
-        "No explanations, no comments outside the code block, no additional text."
-    )
+    return _SYSTEM_PROMPT
 
 
 def get_user_prompt(
@@ -97,12 +129,14 @@ def get_user_prompt(
             for note in df_description["notes"]:
                 fields_description += f"- {note}\n"
     
+    # Статичная часть (структура и описание полей) идёт первой, а задача
+    # пользователя и ошибка - в конце, чтобы общий префикс запросов был длиннее
     base_prompt = (
-        "User task (in natural language):\n"
-        f"{user_task}\n\n"
         "DataFrame structure (column -> dtype):\n"
         f"{structure}\n\n"
         f"{fields_description}\n"
+        "User task (in natural language):\n"
+        f"{user_task}\n\n"
     )
     
     if previous_error and previous_code:
@@ -133,8 +167,7 @@ def _extract_code_block(text: str) -> str:
     - обрезает лишние пробелы.
     """
     # Ищем тройные кавычки ```...```
-    code_fence_pattern = re.compile(r"```(?:python)?(.*)```", re.DOTALL | re.IGNORECASE)
-    match = code_fence_pattern.search(text)
+    match = _CODE_FENCE_RE.search(text)
     if match:
         code = match.group(1)
     else:
@@ -142,27 +175,31 @@ def _extract_code_block(text: str) -> str:
 
     # Убираем возможные префиксы типа "Code:" и ведущие/хвостовые пробелы
     code = code.strip()
-    if code.lower().startswith("code:"):
-        code = code[5:].strip()
+    if code[:len(_CODE_PREFIX)].lower() == _CODE_PREFIX:
+        code = code[len(_CODE_PREFIX):].strip()
 
     return code
 
 
+# Строится один раз при импорте
+_RELEVANCE_CHECK_SYSTEM_PROMPT = (
+    "You are a data analyst assistant. Your task is to determine if a user's question "
+    "can be answered using the vacancies.json dataset.\n\n"
+    "The dataset contains information about job vacancies with fields like: "
+    "vacancy_id, published_at, position, specialization, seniority, salary_from, "
+    "salary_to, stack (technologies), company_name, location, etc.\n\n"
+    "Respond with ONLY one word:\n"
+    "- 'YES' if the question can be answered using this dataset\n"
+    "- 'NO' if the question is not related to job vacancies data or cannot be answered with this dataset\n\n"
+    "Do not provide any explanation, only 'YES' or 'NO'."
+)
+
+
 def get_relevance_check_system_prompt() -> str:
     """
     System prompt for checking if user's question is relevant to the vacancies dataset.
     """
-    return (
-        "You are a data analyst assistant. Your task is to determine if a user's question "
-        "can be answered using the vacancies.json dataset.\n\n"
-        "The dataset contains information about job vacancies with fields like: "
-        "vacancy_id, published_at, position, specialization, seniority, salary_from, "
-        "salary_to, stack (technologies), company_name, location, etc.\n\n"
-        "Respond with ONLY one word:\n"
-        "- 'YES' if the question can be answered using this dataset\n"
-        "- 'NO' if the question is not related to job vacancies data or cannot be answered with this dataset\n\n"
-        "Do not provide any explanation, only 'YES' or 'NO'."
-    )
+    return _RELEVANCE_CHECK_SYSTEM_PROMPT
 
 
 def _wait_before_request() -> None:
@@ -180,17 +217,36 @@ def _wait_before_request() -> None:
         _last_request_time = time.time()
 
 
-def _make_api_request_with_retry(url: str, headers: Dict[str, str], payload: Dict[str, Any], max_retries: int = 3) -> requests.Response:
+def wait_before_request_burst() -> None:
+    """
+    Выдерживает задержку между запросами один раз перед пачкой параллельных
+    запросов, которые затем отправляются с throttle=False.
+    """
+    _wait_before_request()
+
+
+def _make_api_request_with_retry(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    max_retries: int = 3,
+    stream: bool = False,
+    throttle: bool = True,
+) -> requests.Response:
     """
     Выполняет запрос к API с обработкой 429 ошибок и повторными попытками.
+    При stream=True тело ответа не читается заранее (для SSE).
+    При throttle=False первая попытка отправляется без задержки
+    (задержку уже выдержал вызывающий, см. wait_before_request_burst).
     """
     import logging
     logger = logging.getLogger(__name__)
     
     for attempt in range(max_retries):
-        _wait_before_request()
+        if throttle or attempt > 0:
+            _wait_before_request()
         
-        r = requests.post(url, headers=headers, json=payload, timeout=60)
+        r = _session.post(url, headers=headers, json=payload, timeout=60, stream=stream)
         
         if r.status_code == 429:
             # Rate limit exceeded - используем Retry-After или экспоненциальную задержку
@@ -218,6 +274,7 @@ def _make_api_request_with_retry(url: str, headers: Dict[str, str], payload: Dic
                 logger.warning(f"Rate limit exceeded (429). Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
             
             if attempt < max_retries - 1:
+                r.close()
                 time.sleep(wait_time)
                 continue
             else:
@@ -238,6 +295,86 @@ def _make_api_request_with_retry(url: str, headers: Dict[str, str], payload: Dic
     return r
 
 
+def _json_loads(raw: str | bytes) -> Any:
+    """Разбирает JSON через orjson, если он установлен."""
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _stream_until_code_block(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    throttle: bool = True,
+    cancel_event: Event | None = None,
+) -> str:
+    """
+    Получает ответ модели потоком (SSE) и прерывает генерацию,
+    как только в ответе закрылся первый блок ```...```.
+    Если выставлен cancel_event, соединение закрывается на следующем чанке
+    и выбрасывается LLMRequestCancelled.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise LLMRequestCancelled("LLM request cancelled before sending")
+
+    r = _make_api_request_with_retry(url, headers, {**payload, "stream": True}, stream=True, throttle=throttle)
+    try:
+        # API ответил обычным JSON без потока - читаем целиком
+        if not r.headers.get("Content-Type", "").startswith("text/event-stream"):
+            return r.json()["choices"][0]["message"]["content"]
+
+        parts = []
+        content = ""
+        for line in r.iter_lines():
+            if cancel_event is not None and cancel_event.is_set():
+                raise LLMRequestCancelled("LLM request cancelled while streaming")
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+
+            chunk = _json_loads(data)
+            if "error" in chunk:
+                error = chunk["error"]
+                message = error.get("message", error) if isinstance(error, dict) else error
+                raise requests.exceptions.HTTPError(f"LLM stream returned an error: {message}", response=r)
+
+            # Служебные чанки (например, только с usage) приходят без choices
+            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+
+            # Дальше закрывающей ``` ничего полезного не будет
+            # (сами кавычки могут прийти разными чанками)
+            if "`" in delta:
+                content = "".join(parts)
+                if _CODE_FENCE_RE.search(content):
+                    return content
+
+        return "".join(parts)
+    finally:
+        # Закрытие соединения обрывает генерацию на стороне API
+        r.close()
+
+
+def _cached_chat_completion(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> str:
+    """
+    Возвращает текст ответа модели, используя кеш по (model, messages, temperature).
+    """
+    cache_key = _payload_cache_key(payload)
+    cached = _llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    r = _make_api_request_with_retry(url, headers, payload)
+    data = r.json()
+    content = data["choices"][0]["message"]["content"]
+
+    _llm_cache.set(cache_key, content)
+    return content
+
+
 def check_query_relevance(user_task: str) -> bool:
     """
     Проверяет, связан ли запрос пользователя с данными вакансий.
@@ -267,27 +404,31 @@ def check_query_relevance(user_task: str) -> bool:
     return response.startswith("YES")
 
 
+# Строится один раз при импорте
+_REPORT_SYSTEM_PROMPT = (
+    "You are an experienced data analyst preparing a brief analytical report. "
+    "Your task is to write a clear, concise, and professional summary of the analysis results "
+    "in natural language, as if you were presenting findings to a stakeholder.\n\n"
+    "Guidelines:\n"
+    "- Write in Russian (if the user's question was in Russian) or English (if in English).\n"
+    "- Be extremely concise: write ONLY 1 paragraph maximum (3-5 sentences).\n"
+    "- Highlight the most important findings and insights from the metrics.\n"
+    "- Reference the generated plots by their ORDER NUMBER (1st, 2nd, 3rd, etc.) when discussing visualizations.\n"
+    "- NEVER mention file names or paths of plots. Use only order numbers like 'первый график', 'second chart', etc.\n"
+    "- Use specific numbers from the metrics to support your conclusions.\n"
+    "- Write in a professional but accessible tone.\n"
+    "- Do not include technical jargon unless necessary.\n"
+    "- Combine context, key findings, and conclusions in a single paragraph.\n\n"
+    "Important: When referring to plots, use their order number (1st, 2nd, 3rd) instead of file names. "
+    "For example: 'Как видно на первом графике...' or 'The second chart shows that...'"
+)
+
+
 def get_report_system_prompt() -> str:
     """
     System prompt for generating a human-readable analytical report.
     """
-    return (
-        "You are an experienced data analyst preparing a brief analytical report. "
-        "Your task is to write a clear, concise, and professional summary of the analysis results "
-        "in natural language, as if you were presenting findings to a stakeholder.\n\n"
-        "Guidelines:\n"
-        "- Write in Russian (if the user's question was in Russian) or English (if in English).\n"
-        "- Be extremely concise: write ONLY 1 paragraph maximum (3-5 sentences).\n"
-        "- Highlight the most important findings and insights from the metrics.\n"
-        "- Reference the generated plots by their ORDER NUMBER (1st, 2nd, 3rd, etc.) when discussing visualizations.\n"
-        "- NEVER mention file names or paths of plots. Use only order numbers like 'первый график', 'second chart', etc.\n"
-        "- Use specific numbers from the metrics to support your conclusions.\n"
-        "- Write in a professional but accessible tone.\n"
-        "- Do not include technical jargon unless necessary.\n"
-        "- Combine context, key findings, and conclusions in a single paragraph.\n\n"
-        "Important: When referring to plots, use their order number (1st, 2nd, 3rd) instead of file names. "
-        "For example: 'Как видно на первом графике...' or 'The second chart shows that...'"
-    )
+    return _REPORT_SYSTEM_PROMPT
 
 
 def _convert_to_json_serializable(obj: Any) -> Any:
@@ -319,14 +460,18 @@ def get_report_user_prompt(user_task: str, analytics_result: Dict[str, Any]) ->
     - the original user's question/task,
     - the computed analytics results (metrics and plots).
     """
-    import json
-    
     # Преобразуем метрики в JSON-сериализуемый формат
     metrics = analytics_result.get("metrics", {})
     metrics_serializable = _convert_to_json_serializable(metrics)
     
     # Форматируем метрики для читаемости
-    metrics_str = json.dumps(metrics_serializable, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        metrics_str = orjson.dumps(
+            metrics_serializable,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+        ).decode()
+    else:
+        metrics_str = json.dumps(metrics_serializable, ensure_ascii=False, indent=2)
     
     # Форматируем информацию о графиках с номерами по порядку
     plots_info = analytics_result.get("plots", [])
@@ -352,28 +497,79 @@ def get_report_user_prompt(user_task: str, analytics_result: Dict[str, Any]) ->
     )
 
 
-def llm_request(user_prompt: str, system_prompt: str) -> str:
+def _code_payload(user_prompt: str, system_prompt: str, temperature: float) -> Dict[str, Any]:
+    """Тело запроса на генерацию кода; из него же строится ключ кеша."""
+    return {
+        "model": "llama-3.3-70b-versatile",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": temperature,
+    }
+
+
+def _payload_cache_key(payload: Dict[str, Any]) -> str:
+    """Ключ кеша по (model, messages, temperature) из тела запроса."""
+    return make_cache_key(payload["model"], payload["messages"], payload["temperature"])
+
+
+def get_cached_code(user_prompt: str, system_prompt: str, temperature: float = 0.2) -> str | None:
+    """Возвращает ранее сработавший код для этого запроса или None."""
+    payload = _code_payload(user_prompt, system_prompt, temperature)
+    return _llm_cache.get(_payload_cache_key(payload))
+
+
+def forget_cached_code(user_prompt: str, system_prompt: str, temperature: float = 0.2) -> None:
+    """Удаляет код из кеша, например если он перестал выполняться."""
+    payload = _code_payload(user_prompt, system_prompt, temperature)
+    _llm_cache.delete(_payload_cache_key(payload))
+
+
+def remember_successful_code(
+    user_prompt: str,
+    system_prompt: str,
+    code: str,
+    temperature: float = 0.2,
+) -> None:
+    """
+    Кеширует код, который успешно выполнился, для этого же запроса.
+
+    Код кешируется только после выполнения, чтобы неудачный ответ
+    модели не повторялся из кеша при следующих попытках.
+    """
+    payload = _code_payload(user_prompt, system_prompt, temperature)
+    _llm_cache.set(_payload_cache_key(payload), code)
+
+
+def llm_request(
+    user_prompt: str,
+    system_prompt: str,
+    temperature: float = 0.2,
+    throttle: bool = True,
+    cancel_event: Event | None = None,
+) -> str:
     """
     Make a request to the Groq LLM and return the cleaned code string.
+    Returns cached code if the same request previously produced working code
+    (see remember_successful_code). Pass throttle=False only after calling
+    wait_before_request_burst for a batch of parallel requests. Setting
+    cancel_event closes the in-flight response (raises LLMRequestCancelled).
     """
+    payload = _code_payload(user_prompt, system_prompt, temperature)
+    cached = _llm_cache.get(_payload_cache_key(payload))
+    if cached is not None:
+        return cached
+
     url = "https://api.groq.com/openai/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {os.environ['API_KEY']}",
         "Content-Type": "application/json",
     }
-    payload = {
-        "model": "llama-3.3-70b-versatile",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        "temperature": 0.2,
-    }
-
-    r = _make_api_request_with_retry(url, headers, payload)
-    data = r.json()
 
-    raw_content = data["choices"][0]["message"]["content"]
+    raw_content = _stream_until_code_block(
+        url, headers, payload, throttle=throttle, cancel_event=cancel_event
+    )
     return _extract_code_block(raw_content)
 
 
@@ -396,8 +592,5 @@ def llm_request_report(user_prompt: str, system_prompt: str) -> str:
         "temperature": 0.7,  # Немного выше для более естественного текста
     }
 
-    r = _make_api_request_with_retry(url, headers, payload)
-    data = r.json()
-
-    return data["choices"][0]["message"]["content"].strip()
+    return _cached_chat_completion(url, headers, payload).strip()
 
@@ -1,10 +1,11 @@
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
+from threading import Event
 from typing import Any, Dict, List
 
 from config import API_KEY, DEBUG
-from data_utils import load_description
 from llm_request import (
     get_system_prompt,
     get_user_prompt,
@@ -13,11 +14,15 @@ from llm_request import (
     get_report_user_prompt,
     llm_request_report,
     check_query_relevance,
+    forget_cached_code,
+    get_cached_code,
+    remember_successful_code,
+    wait_before_request_burst,
 )
-from code_executor import execute_generated_code, CodeValidationError
 
 
 GENERATED_CODE_DIR = Path("generated_code")
+ATTEMPT_TEMPERATURES = (0.2, 0.4, 0.6)  # Температуры параллельных попыток генерации кода
 
 
 def _save_generated_code(code: str, user_task: str) -> Path:
@@ -59,6 +64,32 @@ def _cleanup_plots(plots: List[Dict[str, Any]]) -> None:
                 print(f"Warning: Failed to delete plot file {path}: {e}")
 
 
+def _handle_success(code: str, user_task: str, analytics_result: Dict[str, Any]) -> None:
+    """Сохраняет код, печатает результаты и отчет, удаляет графики."""
+    # Сохраняем успешно выполненный код
+    _save_generated_code(code, user_task)
+    print("ANALYTICS_RESULT:")
+    print(analytics_result)
+
+    # Генерируем краткий отчет на основе результатов
+    print("\n--- Generating analytical report ---")
+    report_system_prompt = get_report_system_prompt()
+    report_user_prompt = get_report_user_prompt(user_task, analytics_result)
+    report = llm_request_report(report_user_prompt, report_system_prompt)
+
+    print("\n" + "=" * 80)
+    print("ANALYTICAL REPORT:")
+    print("=" * 80)
+    print(report)
+    print("=" * 80)
+
+    # Удаляем графики после успешного выполнения
+    plots = analytics_result.get("plots") or []
+    if plots:
+        _cleanup_plots(plots)
+        print(f"\nCleaned up {len(plots)} plot file(s)")
+
+
 def main() -> None:
     print(f"DEBUG={DEBUG}")
     print(f"API_KEY={'set' if API_KEY else 'not set'}")
@@ -82,84 +113,116 @@ def main() -> None:
 
     print("✅ Query is relevant to vacancies data. Proceeding with analysis...")
 
+    # Импортируем здесь: data_utils и code_executor тянут pandas/matplotlib,
+    # которые не нужны, если запрос отклонён проверкой релевантности
+    from code_executor import execute_generated_code, CodeValidationError
+    from data_utils import load_description
+
     # Загружаем описание данных из description.json
     structure_info, description_info = load_description()
 
     # Формируем system prompt (он не меняется между попытками)
     system_prompt = get_system_prompt()
 
-    # Механизм повторных попыток
-    max_attempts = 3
+    # Механизм повторных попыток: в каждом раунде параллельно запрашиваем
+    # несколько вариантов кода с разной температурой и берём первый рабочий
+    max_rounds = 2
     previous_error = None
     previous_code = None
 
-    for attempt in range(1, max_attempts + 1):
-        print(f"\n--- Attempt {attempt}/{max_attempts} ---")
-        
-        # Формируем user prompt (с ошибкой, если это повторная попытка)
+    for round_num in range(1, max_rounds + 1):
+        print(f"\n--- Round {round_num}/{max_rounds} ({len(ATTEMPT_TEMPERATURES)} parallel attempts) ---")
+
+        # Формируем user prompt (с ошибкой, если это повторный раунд)
         user_prompt = get_user_prompt(
-            user_task, 
-            structure_info, 
+            user_task,
+            structure_info,
             description_info,
             previous_error=previous_error,
             previous_code=previous_code,
         )
 
-        # Запрашиваем код у LLM
-        code = llm_request(user_prompt=user_prompt, system_prompt=system_prompt)
+        # Если такой же запрос уже давал рабочий код, выполняем его без обращения к API
+        for t in ATTEMPT_TEMPERATURES:
+            cached_code = get_cached_code(user_prompt, system_prompt, temperature=t)
+            if cached_code is None:
+                continue
+            print(f"Using cached code (temperature={t})")
+            try:
+                analytics_result = execute_generated_code(cached_code)
+            except Exception as e:  # noqa: BLE001
+                # Код перестал работать (например, изменились данные) - убираем его из кеша
+                print(f"❌ Cached code failed: {type(e).__name__}: {e}")
+                forget_cached_code(user_prompt, system_prompt, temperature=t)
+                continue
+            print("\n✅ Code executed successfully!")
+            _handle_success(cached_code, user_task, analytics_result)
+            return
+
+        # Запрашиваем код у LLM параллельно и проверяем варианты по мере готовности.
+        # Задержка между запросами к API выдерживается один раз на всю пачку.
+        # После первого успешного варианта cancel_event обрывает потоки
+        # остальных ответов, чтобы они не расходовали токены и лимит API.
+        wait_before_request_burst()
+        cancel_event = Event()
+        executor = ThreadPoolExecutor(max_workers=len(ATTEMPT_TEMPERATURES))
+        futures = {
+            executor.submit(
+                llm_request,
+                user_prompt=user_prompt,
+                system_prompt=system_prompt,
+                temperature=t,
+                throttle=False,
+                cancel_event=cancel_event,
+            ): t
+            for t in ATTEMPT_TEMPERATURES
+        }
+        code = None
+        analytics_result = None
+        request_error: Exception | None = None
 
         try:
-            analytics_result = execute_generated_code(code)
+            for future in as_completed(futures):
+                try:
+                    code = future.result()
+                except Exception as e:  # noqa: BLE001
+                    request_error = e
+                    print(f"❌ LLM request failed: {type(e).__name__}: {e}")
+                    continue
+
+                try:
+                    analytics_result = execute_generated_code(code)
+                    remember_successful_code(user_prompt, system_prompt, code, temperature=futures[future])
+                    break
+                except CodeValidationError as e:
+                    previous_error = str(e)
+                    previous_code = code
+                    print(f"❌ Generated code was rejected as unsafe: {previous_error}")
+                    print(f"Code snippet: {code[:500]}...")
+                except Exception as e:  # noqa: BLE001
+                    previous_error = f"{type(e).__name__}: {str(e)}"
+                    previous_code = code
+                    print(f"❌ Code execution failed: {previous_error}")
+                    print(f"Code snippet: {code[:500]}...")
+        finally:
+            # Остальные варианты больше не нужны: обрываем их потоки и не ждём
+            cancel_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if analytics_result is not None:
             # Успех!
             print("\n✅ Code executed successfully!")
-            # Сохраняем успешно выполненный код
-            _save_generated_code(code, user_task)
-            print("ANALYTICS_RESULT:")
-            print(analytics_result)
-            
-            # Генерируем краткий отчет на основе результатов
-            print("\n--- Generating analytical report ---")
-            report_system_prompt = get_report_system_prompt()
-            report_user_prompt = get_report_user_prompt(user_task, analytics_result)
-            report = llm_request_report(report_user_prompt, report_system_prompt)
-            
-            print("\n" + "=" * 80)
-            print("ANALYTICAL REPORT:")
-            print("=" * 80)
-            print(report)
-            print("=" * 80)
-            
-            # Удаляем графики после успешного выполнения
-            plots = analytics_result.get("plots") or []
-            if plots:
-                _cleanup_plots(plots)
-                print(f"\nCleaned up {len(plots)} plot file(s)")
-            
+            _handle_success(code, user_task, analytics_result)
             return
-        except CodeValidationError as e:
-            error_msg = str(e)
-            print(f"❌ Generated code was rejected as unsafe: {error_msg}")
-            print(f"Code snippet: {code[:500]}...")
-            
-            if attempt < max_attempts:
-                previous_error = error_msg
-                previous_code = code
-                print(f"Retrying with error feedback...")
-            else:
-                print(f"\n❌ Failed after {max_attempts} attempts. Giving up.")
-                return
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-            print(f"❌ Code execution failed: {error_msg}")
-            print(f"Code snippet: {code[:500]}...")
-            
-            if attempt < max_attempts:
-                previous_error = error_msg
-                previous_code = code
-                print(f"Retrying with error feedback...")
-            else:
-                print(f"\n❌ Failed after {max_attempts} attempts. Giving up.")
-                return
+
+        if code is None and request_error is not None:
+            # Ни один запрос к LLM не завершился успешно
+            raise request_error
+
+        if round_num < max_rounds:
+            print("Retrying with error feedback...")
+
+    print(f"\n❌ Failed after {max_rounds} rounds. Giving up.")
 
 
 if __name__ == "__main__":
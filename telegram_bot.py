@@ -22,6 +22,7 @@ from llm_request import (
     get_report_user_prompt,
     llm_request_report,
     check_query_relevance,
+    remember_successful_code,
 )
 from code_executor import execute_generated_code, CodeValidationError
 
@@ -93,6 +94,7 @@ def _run_analysis(user_task: str) -> Dict[str, Any]:
 
         try:
             analytics_result = execute_generated_code(code)
+            remember_successful_code(user_prompt, system_prompt, code)
             # Сохраняем успешно выполненный код
             _save_generated_code(code, user_task)
             return analytics_result